@@ -0,0 +1 @@
+"""TealScan portfolio health engine."""
@@ -0,0 +1,369 @@
+"""
+TealScan core: CAS parsing, classification, XIRR metrics and the portfolio frame.
+Pure Python/pandas (no Streamlit), so app.py stays a thin UI over scan();
+analyze() is the same pipeline without the cache.
+"""
+import hashlib
+import io
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# On-disk result cache. XIRR is measured up to today, so entries expire daily.
+CACHE_DIR = Path.home() / ".tealscan_cache"
+CACHE_TTL = 24 * 60 * 60
+
+def parse_cas(pdf_bytes, pwd, accurate=False):
+    """
+    Parse the CAS with the fast MuPDF backend first.
+    Falls back to pdfminer if the fast parse fails or finds no folios.
+    casparser closes the stream it is given, so each attempt gets a fresh BytesIO.
+    """
+    # Imported lazily: casparser pulls in both PDF backends, which only a scan needs
+    import casparser
+    from casparser.exceptions import CASParseError, IncorrectPasswordError
+
+    if not accurate:
+        try:
+            data = casparser.read_cas_pdf(io.BytesIO(pdf_bytes), pwd)
+            if data.folios:
+                return data
+        except IncorrectPasswordError:
+            raise
+        except CASParseError:
+            pass
+    return casparser.read_cas_pdf(io.BytesIO(pdf_bytes), pwd, force_pdfminer=True)
+
+# Keyword rules (precompiled), checked in order: the first matching pattern wins.
+ASSET_CLASS_RULES = [
+    ("Debt", re.compile(r"LIQUID|OVERNIGHT|BOND|DEBT|GILT|TREASURY")),
+    ("Commodity", re.compile(r"GOLD|SILVER|COMMODITIES")),
+    ("Hybrid", re.compile(r"HYBRID|BALANCED|DYNAMIC")),
+]
+
+SUB_CATEGORY_RULES = [
+    ("Small Cap", re.compile(r"SMALL CAP")),
+    ("Mid Cap", re.compile(r"MID CAP")),
+    ("Large & Mid Cap", re.compile(r"LARGE.*MID|MID.*LARGE")),
+    ("Large Cap", re.compile(r"LARGE CAP")),
+    ("Flexi Cap", re.compile(r"FLEXI")),
+    ("ELSS (Tax Saver)", re.compile(r"ELSS|TAX SAVER")),
+    ("Index Fund", re.compile(r"INDEX")),
+    ("Multi Cap", re.compile(r"MULTI")),
+    ("Value Fund", re.compile(r"VALUE")),
+]
+
+def _classify(names_upper, rules, default):
+    """
+    One regex pass per rule over the unique names, resolved with np.select.
+    A fund held across several folios is classified once and broadcast back.
+    Returns a Categorical whose categories are the rule labels, then the default.
+    """
+    codes, uniques = pd.factorize(names_upper)
+    conditions = [uniques.str.contains(pattern) for _, pattern in rules]
+    label_codes = np.select(conditions, range(len(rules)), default=len(rules))[codes]
+    return pd.Categorical.from_codes(label_codes, categories=[label for label, _ in rules] + [default])
+
+def get_asset_class(names_upper):
+    """Broad Asset Class (Equity vs Debt) for a Series of upper-cased fund names"""
+    return _classify(names_upper, ASSET_CLASS_RULES, "Equity")
+
+def get_detailed_category(names_upper):
+    """Specific Category for Overlap Checks, for a Series of upper-cased fund names"""
+    return _classify(names_upper, SUB_CATEGORY_RULES, "Other Equity")
+
+# Transaction description keywords (precompiled). Buy keywords win if both match.
+_BUY_RE = re.compile(r"PURCHASE|SIP|SWITCH IN|STP IN|DIVIDEND")
+_SELL_RE = re.compile(r"REDEMPTION|SWITCH OUT|STP OUT|SWP")
+
+def flatten_schemes(data, min_value=100):
+    """
+    Yield (name, value, cost, transactions) per scheme, skipping holdings below min_value.
+    Walks folios/schemes and their valuation attributes once; callers work on plain tuples.
+    """
+    for folio in data.folios:
+        for scheme in folio.schemes:
+            valuation = scheme.valuation
+            value = float(valuation.value or 0)
+            if value >= min_value:
+                yield scheme.scheme, value, float(valuation.cost or 0), scheme.transactions
+
+def build_cashflows(holdings):
+    """
+    Flatten every holding's non-zero transactions into one frame (sid, date, amt, signed).
+    Sign logic: Money OUT (-), Money IN (+), resolved per unique description.
+    """
+    txn_lists = [txns for _, _, _, txns in holdings]
+    txns = [txn for txn_list in txn_lists for txn in txn_list]
+    cashflows = pd.DataFrame({
+        "sid": np.repeat(np.arange(len(txn_lists)), [len(txn_list) for txn_list in txn_lists]),
+        # Object dtype even when there are no transactions at all (summary-only CAS)
+        "date": pd.Series([txn.date for txn in txns], dtype=object),
+        "amt": np.fromiter((float(txn.amount or 0) for txn in txns), dtype=np.float64, count=len(txns)),
+        "desc": pd.Series([str(txn.description) for txn in txns], dtype=object),
+    })
+    # Zero-amount rows (stamp duty notes, address changes) never reach XIRR: drop them up front
+    cashflows = cashflows[cashflows["amt"] != 0].reset_index(drop=True)
+    cashflows["signed"] = _assign_signs(cashflows["amt"].to_numpy(), _is_sell(cashflows["desc"]))
+    return cashflows
+
+def _is_sell(descriptions):
+    """
+    Sell flag per transaction description, as a NumPy bool array.
+    Descriptions repeat heavily (every SIP instalment), so the keyword regexes
+    run once per unique description and are broadcast back.
+    """
+    codes, uniques = pd.factorize(descriptions)
+    uniques = uniques.str.upper()
+    return (uniques.str.contains(_SELL_RE) & ~uniques.str.contains(_BUY_RE))[codes]
+
+def _assign_signs(amounts, is_sell):
+    """Signed cash flows in one NumPy pass: sells stay positive, everything else is money out"""
+    return np.where(is_sell, amounts, -amounts)
+
+def batch_xirr(sids, days, flows, final_values, final_day, max_iter=50, tol=1e-9):
+    """
+    Vectorized Newton-Raphson XIRR for every holding at once.
+    sids / days / flows: all cash flows (holding id, day number, signed amount), grouped by sid.
+    Each holding also receives final_values[sid] on final_day (its current value).
+    Flows are padded into an (n_holdings, max_flows) matrix, so each iteration is a few NumPy
+    reductions. Returns annual rates; NaN where Newton didn't converge (callers fall back to pyxirr).
+    """
+    n = len(final_values)
+    counts = np.bincount(sids, minlength=n)
+    width = counts.max(initial=0) + 1
+    pos = np.arange(len(sids)) - (np.cumsum(counts) - counts)[sids]
+    rows = np.arange(n)
+
+    # Padding is a zero flow on final_day, so it adds nothing to either sum
+    cf = np.zeros((n, width))
+    d = np.full((n, width), final_day, dtype=np.float64)
+    cf[sids, pos] = flows
+    d[sids, pos] = days
+    cf[rows, counts] = final_values
+    # Year offsets back from final_day (Actual/365). Valuing every flow at final_day makes
+    # each row's NPV monotonic in r for ordinary buy-then-hold histories, which keeps Newton stable.
+    t = (d - final_day) / 365.0
+    neg_t = -t
+
+    r = np.full(n, 0.1)
+    terms = np.empty_like(cf)  # cf * (1 + r) ** -t, reused across iterations
+    with np.errstate(all="ignore"):
+        for _ in range(max_iter):
+            # Fused in place: one pow and one multiply per iteration, no fresh (n, width) temporaries
+            np.power((1.0 + r)[:, None], neg_t, out=terms)
+            terms *= cf
+            f = terms.sum(axis=1)
+            fp = np.einsum("ij,ij->i", neg_t, terms) / (1.0 + r)
+            step = f / fp
+            r_next = r - step
+            # Never step to or past -100%: go halfway there instead
+            r = np.where(r_next <= -1.0, (r - 1.0) / 2.0, r_next)
+            if not np.any(np.abs(step) > 1e-12):
+                break
+
+        terms = cf * (1.0 + r[:, None]) ** -t
+        converged = np.isfinite(r) & (np.abs(terms.sum(axis=1)) <= tol * np.abs(terms).sum(axis=1))
+    # Redemptions between purchases can give the XIRR equation several roots. Only trust
+    # Newton when every outflow precedes every inflow (one sign change, so one root);
+    # other histories go to pyxirr, which picks the root the app has always reported.
+    last_out = np.where(cf < 0, d, -np.inf).max(axis=1)
+    first_in = np.where(cf > 0, d, np.inf).min(axis=1)
+    return np.where(converged & (last_out <= first_in), r, np.nan)
+
+def calculate_metrics(holding, dates, amounts, signed, today, rate=np.nan):
+    """
+    Smart calculation that handles 'Partial Data' gracefully.
+    holding: (name, value, cost, transactions) from flatten_schemes.
+    dates / amounts / signed: this holding's rows from build_cashflows, as NumPy arrays.
+    today: valuation date for current_val, shared by the whole run.
+    rate: XIRR from batch_xirr if it converged; otherwise NaN and pyxirr solves it here.
+    Returns: (XIRR, Absolute_Return, Status_Message)
+    """
+    from pyxirr import xirr
+
+    _, current_val, total_cost, transactions = holding
+    
+    # 1. Calculate Absolute Return
+    abs_return = 0.0
+    if total_cost > 0:
+        abs_return = ((current_val - total_cost) / total_cost) * 100
+
+    # 2. Check for "No Transaction" Case
+    if not transactions:
+        return None, abs_return, "No History"
+
+    # 3. Try XIRR Calculation
+    try:
+        # Check for Partial Data (Opening Balance Mismatch)
+        invested_sum = amounts.sum()
+        if invested_sum > 0 and (current_val / invested_sum) > 5.0 and total_cost > invested_sum:
+             return None, abs_return, "Partial Data"
+
+        if np.isfinite(rate):
+            res = rate
+        else:
+            # Add Current Value
+            res = xirr(np.append(dates, today), np.append(signed, current_val))
+        
+        if res is None: 
+            return None, abs_return, "Calc Error"
+        
+        xirr_val = res * 100
+        
+        # Sanity Check
+        if xirr_val > 100.0 or xirr_val < -90.0:
+             return None, abs_return, "Data Mismatch"
+             
+        return xirr_val, abs_return, "OK"
+
+    except Exception:
+        return None, abs_return, "Error"
+
+def calculate_all_metrics(holdings, cashflows, today=None, max_workers=8):
+    """
+    calculate_metrics for every holding, fanned out over a thread pool when enough
+    holdings are left for pyxirr (small portfolios run inline).
+    today defaults to date.today(), read once so every holding is valued on the same day.
+    XIRR is first solved for all holdings at once by batch_xirr; only the ones it
+    can't settle call pyxirr. Results keep holding order.
+    """
+    sids = cashflows["sid"].to_numpy()
+    dates = cashflows["date"].to_numpy()
+    amounts = cashflows["amt"].to_numpy()
+    signed = cashflows["signed"].to_numpy()
+    index = cashflows.groupby("sid", sort=False).indices
+    no_txns = np.array([], dtype=np.intp)
+    today = today or date.today()
+
+    final_values = np.array([value for _, value, _, _ in holdings], dtype=np.float64)
+    try:
+        # Day numbers via toordinal(): much cheaper than astype("datetime64[D]") on an object array
+        days = np.fromiter((d.toordinal() for d in dates), dtype=np.int64, count=len(dates))
+        rates = batch_xirr(sids, days, signed, final_values, today.toordinal())
+    except (AttributeError, TypeError, ValueError):
+        rates = np.full(len(holdings), np.nan)  # Unparseable dates: every holding goes to pyxirr
+
+    def scheme_metrics(sid):
+        idx = index.get(sid, no_txns)
+        return calculate_metrics(holdings[sid], dates[idx], amounts[idx], signed[idx], today, rates[sid])
+
+    # Threads only pay off when several holdings still need a pyxirr solve
+    workers = min(max_workers, os.cpu_count() or 1, int(np.isnan(rates).sum()))
+    if workers <= 1 or len(holdings) <= 4:
+        return [scheme_metrics(sid) for sid in range(len(holdings))]
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        return list(ex.map(scheme_metrics, range(len(holdings))))
+
+def value_by(df, col):
+    """Total Value per label of `col` that occurs, via np.bincount on integer codes (no groupby)"""
+    values = df[col]
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        labels, codes = values.cat.categories.to_numpy(), values.cat.codes.to_numpy()
+    else:
+        labels, codes = np.unique(values.to_numpy(), return_inverse=True)
+    totals = np.bincount(codes, weights=df["Value"].to_numpy(), minlength=len(labels))
+    present = np.bincount(codes, minlength=len(labels)) > 0
+    return pd.DataFrame({col: labels[present], "Value": totals[present]})
+
+# Rating buckets, best first
+RATINGS = ["🔥 IN-FORM", "✅ ON-TRACK", "⚠️ OFF-TRACK", "❌ OUT-OF-FORM"]
+# Lower edges of OFF-TRACK (> 0), ON-TRACK (>= 12) and IN-FORM (>= 20), for searchsorted(side="right").
+# The first edge is the smallest float above 0 so that exactly 0% stays OUT-OF-FORM.
+_RATING_EDGES = np.array([np.nextafter(0.0, 1.0), 12.0, 20.0])
+
+def get_fund_rating(xirr_vals, abs_vals):
+    """Rating Logic with Fallback: XIRR where available, else Absolute Return (branchless bucketing, Categorical)"""
+    val = np.where(pd.isna(xirr_vals), abs_vals, xirr_vals)
+    # NaN would sort past every edge, so treat it as 0 (OUT-OF-FORM), as the comparisons did
+    bucket = np.searchsorted(_RATING_EDGES, np.nan_to_num(np.asarray(val, dtype=np.float64), nan=0.0), side="right")
+    return pd.Categorical.from_codes(len(RATINGS) - 1 - bucket, categories=RATINGS)
+
+def build_portfolio(data, today=None):
+    """Scheme-level portfolio frame (values, metrics, classifications) from parsed CAS data, valued as of today"""
+    holdings = list(flatten_schemes(data))
+
+    # Metrics (XIRR solves run on a thread pool)
+    cashflows = build_cashflows(holdings)
+    metrics = calculate_all_metrics(holdings, cashflows, today=today)
+
+    # Column-wise, with explicit dtypes: no per-row records, no column inference
+    names, values, costs, _ = zip(*holdings) if holdings else ((), (), (), ())
+    xirrs, abs_returns, statuses = zip(*metrics) if metrics else ((), (), ())
+    df = pd.DataFrame({
+        "Fund Name": pd.Series(names, dtype=object),  # object even with no holdings, for .str
+        "Value": np.asarray(values, dtype=np.float64),
+        "Invested": np.asarray(costs, dtype=np.float64),
+        "XIRR": np.asarray(xirrs, dtype=np.float64),  # None -> NaN
+        "Abs Return": np.asarray(abs_returns, dtype=np.float64),
+        "Status": pd.Series(statuses, dtype=object),
+    })
+    df.insert(5, "Rating", get_fund_rating(df["XIRR"], df["Abs Return"]))
+
+    # Classifications (vectorized; names are upper-cased once and shared)
+    names_upper = df["Fund Name"].str.upper()
+    is_regular = ~names_upper.str.contains("DIRECT", regex=False)
+    df.insert(1, "Category", get_asset_class(names_upper))
+    df.insert(2, "Sub-Category", get_detailed_category(names_upper))
+    df.insert(5, "Type", pd.Categorical.from_codes(is_regular.to_numpy(dtype=np.int8), categories=["Direct 🟢", "Regular 🔴"]))
+    df.insert(6, "is_regular", is_regular)
+    return df
+
+def analyze(pdf_bytes, password, accurate=False):
+    """Uncached parse + metrics: the portfolio frame for a CAS PDF (usable from a CLI or profiler)"""
+    return build_portfolio(parse_cas(pdf_bytes, password, accurate=accurate))
+
+def file_digest(pdf_bytes):
+    """blake2b hex digest of an upload, the key for every cache layer"""
+    return hashlib.blake2b(pdf_bytes).hexdigest()
+
+def cache_key(file_key, password, accurate=False):
+    """
+    Disk/memory cache key for one scan: blake2b over PDF digest, parser mode and password.
+    Fields are NUL-separated and the password goes last, so no two inputs share a key.
+    """
+    mode = "pdfminer" if accurate else "mupdf"
+    return hashlib.blake2b("\0".join([file_key, mode, password]).encode(), person=b"tealscan-scan").hexdigest()
+
+def _prune_cache(now):
+    """Delete saved scans older than CACHE_TTL: they are never served again, and they hold decrypted holdings"""
+    for stale in CACHE_DIR.glob("*.parquet"):
+        try:
+            if now - stale.stat().st_mtime >= CACHE_TTL:
+                stale.unlink()
+        except OSError:
+            pass  # Raced with another session, or not ours to delete
+
+def scan(pdf_bytes, password, accurate=False, key=None):
+    """
+    Portfolio frame for an upload, persisted as Parquet under CACHE_DIR.
+    Keyed on cache_key(digest, password, mode), so a re-uploaded monthly CAS skips parsing and XIRR.
+    Pass key when the caller has already computed it.
+    """
+    key = key or cache_key(file_digest(pdf_bytes), password, accurate)
+    path = CACHE_DIR / f"{key}.parquet"
+    now = time.time()
+    try:
+        if now - path.stat().st_mtime < CACHE_TTL:
+            return pd.read_parquet(path)
+    except (OSError, ValueError):
+        pass  # Missing, unreadable or corrupt: rebuild below
+
+    _prune_cache(now)
+    df = analyze(pdf_bytes, password, accurate=accurate)
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        df.to_parquet(path, index=False)
+    except OSError:
+        pass  # Read-only filesystem: the cache is best-effort
+    return df
+
+def clear_cache(key):
+    """Delete the saved scan for one cache_key (other users' scans are left alone)"""
+    (CACHE_DIR / f"{key}.parquet").unlink(missing_ok=True)
@@ -0,0 +1,118 @@
+"""Tests for tealscan.core on hand-built CAS data (no PDFs needed)."""
+import os
+import time
+from datetime import date
+from types import SimpleNamespace as NS
+
+import numpy as np
+import pytest
+import pyxirr
+
+from tealscan import core
+
+
+def _cas(*schemes):
+    """Parsed-CAS stand-in: one folio holding the given schemes"""
+    return NS(folios=[NS(schemes=list(schemes))])
+
+
+def _scheme(name, value, cost, transactions=()):
+    return NS(scheme=name, valuation=NS(value=value, cost=cost), transactions=list(transactions))
+
+
+def test_no_transactions_is_no_history():
+    df = core.build_portfolio(_cas(_scheme("X Fund - Direct", 1000, 900)))
+    assert df["Status"].tolist() == ["No History"]
+    assert df["XIRR"].isna().all()
+    assert core.build_cashflows(list(core.flatten_schemes(_cas(_scheme("X", 1000, 900))))).empty
+
+
+def test_no_holdings_gives_empty_frame():
+    df = core.build_portfolio(_cas(_scheme("Dust Fund", 50, 40)))  # below min_value
+    assert df.empty
+    assert core.value_by(df, "Category").empty
+
+
+def test_cache_key_separates_password_and_mode():
+    digest = core.file_digest(b"%PDF")
+    assert core.cache_key(digest, "Xpdfminer") != core.cache_key(digest, "X", accurate=True)
+    assert core.cache_key(digest, "X") != core.cache_key(digest, "X", accurate=True)
+
+
+def test_scan_prunes_expired_and_clear_cache_is_per_key(tmp_path, monkeypatch):
+    monkeypatch.setattr(core, "CACHE_DIR", tmp_path)
+    monkeypatch.setattr(core, "analyze", lambda *args, **kwargs: core.build_portfolio(_cas(_scheme("A", 1000, 900))))
+    stale, other = tmp_path / "stale.parquet", tmp_path / "other.parquet"
+    stale.write_bytes(b"old")
+    other.write_bytes(b"new")
+    old = time.time() - core.CACHE_TTL - 1
+    os.utime(stale, (old, old))
+
+    key = core.cache_key(core.file_digest(b"%PDF"), "PAN")
+    core.scan(b"%PDF", "PAN", key=key)
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted([f"{key}.parquet", "other.parquet"])
+
+    core.clear_cache(key)
+    assert [p.name for p in tmp_path.iterdir()] == ["other.parquet"]
+
+
+TODAY = date(2024, 1, 1)
+
+
+def _txn(day, amount, description="SIP Purchase"):
+    return NS(date=day, amount=amount, description=description)
+
+
+def _pyxirr(transactions, value):
+    """Reference rate (%): what calculate_metrics returned before batch_xirr"""
+    flows = [(t.date, -float(t.amount) if "REDEMPTION" not in t.description.upper() else float(t.amount))
+             for t in transactions if t.amount]
+    return pyxirr.xirr([d for d, _ in flows] + [TODAY], [a for _, a in flows] + [value]) * 100
+
+
+def _batch_rates(holdings):
+    cashflows = core.build_cashflows(holdings)
+    days = np.fromiter((d.toordinal() for d in cashflows["date"]), dtype=np.int64, count=len(cashflows))
+    final_values = np.array([value for _, value, _, _ in holdings])
+    return core.batch_xirr(cashflows["sid"].to_numpy(), days, cashflows["signed"].to_numpy(),
+                           final_values, TODAY.toordinal())
+
+
+def _sip(rng, months, start=date(2019, 1, 1)):
+    return [_txn(date(start.year + m // 12, m % 12 + 1, 5), float(rng.integers(1, 20)) * 500) for m in range(months)]
+
+
+def test_batch_xirr_matches_pyxirr_on_buy_only_histories():
+    rng = np.random.default_rng(0)
+    holdings = []
+    for months in (1, 6, 24, 60):
+        txns = _sip(rng, months)
+        invested = sum(t.amount for t in txns)
+        for growth in (0.6, 1.0, 1.4, 2.5):
+            holdings.append((f"Fund {months}/{growth}", invested * growth, invested, txns))
+
+    rates = _batch_rates(holdings)
+    assert np.isfinite(rates).all()
+    expected = [_pyxirr(txns, value) for _, value, _, txns in holdings]
+    np.testing.assert_allclose(rates * 100, expected, atol=1e-6)
+
+
+def test_redemptions_between_purchases_fall_back_to_pyxirr():
+    txns = [_txn(date(2021, 1, 1), 10000), _txn(date(2022, 1, 1), 4000, "Redemption"), _txn(date(2022, 6, 1), 6000)]
+    holdings = [("Mixed", 9000.0, 12000.0, txns)]
+    assert np.isnan(_batch_rates(holdings)).all()
+
+    (my_xirr, _, status), = core.calculate_all_metrics(holdings, core.build_cashflows(holdings), today=TODAY)
+    assert status == "OK"
+    assert my_xirr == pytest.approx(_pyxirr(txns, 9000.0), abs=1e-6)
+
+
+def test_no_root_and_all_zero_histories_are_not_rated_by_batch():
+    holdings = [
+        ("Wiped Out", 0.0, 5000.0, [_txn(date(2021, 1, 1), 5000)]),  # outflows only: no root
+        ("Notes Only", 5000.0, 4000.0, [_txn(date(2021, 1, 1), 0), _txn(date(2022, 1, 1), 0)]),
+    ]
+    assert np.isnan(_batch_rates(holdings)).all()
+
+    metrics = core.calculate_all_metrics(holdings, core.build_cashflows(holdings), today=TODAY)
+    assert [(my_xirr, status) for my_xirr, _, status in metrics] == [(None, "Error"), (None, "Error")]